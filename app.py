@@ -1,19 +1,87 @@
 import uvicorn
+import hmac
+import io
 import os
-import uuid
 import re
+import secrets
 import random
 import json
-from datetime import datetime
+import hashlib
+import asyncio
+import pickle
+import threading
+import time
+import concurrent.futures
+from collections import Counter, OrderedDict
 from typing import Union, List, Dict, Any
+from cachetools import LRUCache, TTLCache
 from fastapi import FastAPI, HTTPException, Security
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from faker import Faker
 from gliner import GLiNER
-
-app = FastAPI(title="Celarium AI")
+import torch
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# orjson is 2-5x faster than stdlib json on the wide payloads /v1/anonymize
+# round-trips; the regex engine needs str, so decode at the boundary.
+if orjson is not None:
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    def _json_pretty(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj)
+
+    def _json_pretty(obj) -> str:
+        return json.dumps(obj, indent=2)
+
+    _json_loads = json.loads
+
+# orjson emits bytes directly and is 2-5x faster than stdlib json, which
+# matters for responses carrying long anonymized/restored texts
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse
+
+    app = FastAPI(title="Celarium AI", default_response_class=ORJSONResponse)
+else:
+    app = FastAPI(title="Celarium AI")
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,16 +91,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Shared pool for CPU-bound anonymization work; the semaphore keeps a single
+# giant list request from thrashing the model.
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count()))
+ANON_CONCURRENCY = asyncio.Semaphore(int(os.getenv("ANON_CONCURRENCY", 8)))
+
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
-VALID_API_KEYS = {"sk_test_celarium_founder_001", "sk_test_celarium_beta_001"}
-SESSIONS = {}
+# Keys are stored pre-encoded and compared with hmac.compare_digest so
+# validation doesn't leak prefix-match timing
+VALID_API_KEYS = frozenset(k.encode() for k in ("sk_test_celarium_founder_001", "sk_test_celarium_beta_001"))
+SESSION_TTL_SEC = int(os.getenv("SESSION_TTL_SEC", 3600))
+
+# Size-bounded TTL store so sessions expire instead of accumulating for the
+# process lifetime; the lock guards it across handler threads. Setting
+# REDIS_URL swaps this for Redis with server-side expiry, which also lets
+# multiple uvicorn workers/replicas share sessions.
+# timer=time.monotonic keeps expiry as cheap float comparisons and immune
+# to wall-clock jumps (which could otherwise expire live sessions)
+SESSIONS = TTLCache(
+    maxsize=int(os.getenv("SESSION_CACHE_MAX", 10000)),
+    ttl=SESSION_TTL_SEC,
+    timer=time.monotonic,
+)
+SESSIONS_LOCK = asyncio.Lock()
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS = None
+
+# Sessions are held as packed bytes (one allocation instead of per-string
+# object headers across the mapping); the derived restore artifacts can't
+# be serialized, so they live in this bounded side LRU keyed by session id.
+RESTORE_CACHES = LRUCache(maxsize=int(os.getenv("RESTORE_CACHE_MAX", 1024)))
+RESTORE_CACHES_LOCK = threading.Lock()
+
+
+def _pack_session(data: dict) -> bytes:
+    """Serialize the portable session core (msgpack when available, pickle
+    protocol 5 otherwise)."""
+    core = {"mapping": data["mapping"], "item_mappings": data["item_mappings"], "api_key": data["api_key"]}
+    if msgpack is not None:
+        return msgpack.packb(core)
+    return pickle.dumps(core, protocol=5)
+
+
+def _unpack_session(blob: bytes) -> dict:
+    if msgpack is not None:
+        return msgpack.unpackb(blob, raw=False)
+    return pickle.loads(blob)
+
+
+async def _put_session(session_id: str, data: dict):
+    cache = data.pop("restore_cache", None)
+    if cache is not None:
+        with RESTORE_CACHES_LOCK:
+            RESTORE_CACHES[session_id] = cache
+    blob = _pack_session(data)
+    if REDIS is not None:
+        await REDIS.set(f"sess:{session_id}", blob, ex=SESSION_TTL_SEC)
+    else:
+        async with SESSIONS_LOCK:
+            SESSIONS[session_id] = blob
+
+
+async def _get_session(session_id: str):
+    if REDIS is not None:
+        blob = await REDIS.get(f"sess:{session_id}")
+    else:
+        async with SESSIONS_LOCK:
+            blob = SESSIONS.get(session_id)
+    if not blob:
+        return None
+    session = _unpack_session(blob)
+    session["session_id"] = session_id
+    with RESTORE_CACHES_LOCK:
+        session["restore_cache"] = RESTORE_CACHES.get(session_id)
+    return session
 fake = Faker()
 
 # Load Model
+# Env-overridable so a bi-encoder checkpoint (e.g.
+# gliner-community/gliner_small-v2.5) can be dropped in: bi-encoders expose
+# encode_labels, which lets us embed the label set once at startup.
+MODEL_NAME = os.getenv("GLINER_MODEL", "urchade/gliner_small-v2.1")
+# For CPU serving, export the checkpoint once and quantize weights to int8:
+#   optimum-cli export onnx --model urchade/gliner_small-v2.1 gliner_onnx/
+#   python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \
+#       quantize_dynamic('gliner_onnx/model.onnx', 'gliner_onnx/model_int8.onnx', weight_type=QuantType.QInt8)"
+# then set GLINER_ONNX_MODEL=gliner_onnx/model_int8.onnx.
+ONNX_MODEL_FILE = os.getenv("GLINER_ONNX_MODEL")
+# Pin the intra/inter-op pools explicitly: the defaults oversubscribe under
+# concurrent requests and latency collapses. Divide TORCH_THREADS by the
+# uvicorn worker count when running multi-worker.
+torch.set_num_threads(int(os.getenv("TORCH_THREADS", 4)))
+torch.set_num_interop_threads(1)
 print("Loading GLiNER...")
-model = GLiNER.from_pretrained("urchade/gliner_small-v2.1")
+if ONNX_MODEL_FILE:
+    model = GLiNER.from_pretrained(MODEL_NAME, load_onnx_model=True, onnx_model_file=ONNX_MODEL_FILE)
+    if hasattr(model, "onnx_session"):
+        model.onnx_session.intra_op_num_threads = int(os.getenv("ORT_THREADS", os.cpu_count()))
+else:
+    model = GLiNER.from_pretrained(MODEL_NAME)
 print("Loaded.")
 
+# GLiNER latency degrades sharply past its internal token window; cap what a
+# single forward pass sees (roughly 384 tokens worth of characters).
+MAX_MODEL_CHARS = int(os.getenv("MAX_MODEL_CHARS", 1536))
+
 # Regex & Labels
 REGEX_PATTERNS = {
     "EMAIL_ADDRESS": r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
@@ -40,29 +203,83 @@ REGEX_PATTERNS = {
     "MRN": r'\bMRN[-_]\w+\b',
     "SSN": r'\b\d{3}-\d{2}-\d{4}\b',
     "INSURANCE_GROUP": r'\bG\d{5,}\b',
-    "INSURANCE_POLICY": r'\b(POL|POLICY)[-_]?\d+\b',
+    "INSURANCE_POLICY": r'\b(?:POL|POLICY)[-_]?\d+\b',
     "FULL_ADDRESS": r'\d+\s+[A-Za-z0-9\s\.]+,\s+[A-Za-z\s\.]+,\s+[A-Z]{2}\s+\d{5}(?:-\d{4})?'
 }
 AI_LABELS = ["person", "physical address", "organization", "date of birth"]
+AI_THRESHOLD = 0.35
+
+# Pre-encode the (tiny, fixed) label vocabulary when the checkpoint supports
+# it, so per-request inference only pays for the text encoder.
+LABEL_EMB = model.encode_labels(AI_LABELS) if hasattr(model, "encode_labels") else None
+
+# Compile once at import: per-label patterns plus a single union regex with
+# named groups, so one pass over the text yields every regex finding.
+COMPILED_PATTERNS = {label: re.compile(pattern) for label, pattern in REGEX_PATTERNS.items()}
+UNION_PATTERN = re.compile("|".join(f"(?P<{label}>{pattern})" for label, pattern in REGEX_PATTERNS.items()))
+REGEX_LABELS = list(REGEX_PATTERNS.keys())
+
+# Optional: compile all patterns into one Hyperscan database so the buffer is
+# scanned once with SIMD block matching. Falls back to the union regex if the
+# package is missing or the patterns don't compile on this build.
+HS_DB = None
+if hyperscan is not None:
+    try:
+        HS_DB = hyperscan.Database()
+        HS_DB.compile(
+            expressions=[p.encode() for p in REGEX_PATTERNS.values()],
+            ids=list(range(len(REGEX_PATTERNS))),
+            flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * len(REGEX_PATTERNS),
+        )
+    except hyperscan.error:
+        HS_DB = None
 
 
 # Generators
+# Faker's provider chain is too slow to sit on the per-entity hot path, so
+# the building blocks are pre-generated into flat pools at import; the
+# generators below just index into them.
+POOL_FIRST = [fake.first_name() for _ in range(8192)]
+POOL_LAST = [fake.last_name() for _ in range(8192)]
+POOL_CITY = [fake.city() for _ in range(4096)]
+POOL_STREET = [fake.street_address() for _ in range(8192)]
+POOL_ZIP = [fake.zipcode() for _ in range(4096)]
+POOL_STATE = [fake.state_abbr() for _ in range(128)]
+POOL_SSN = [fake.ssn() for _ in range(4096)]
+POOL_DOB = [str(fake.date_of_birth(minimum_age=18, maximum_age=90)) for _ in range(4096)]
+
+# Per-thread RNGs: the module-level random functions share one instance (and
+# its lock) across executor workers, and randint pays rejection-sampling
+# overhead that getrandbits doesn't.
+_RNG_LOCAL = threading.local()
+
+
+def _rng() -> random.Random:
+    rng = getattr(_RNG_LOCAL, "rng", None)
+    if rng is None:
+        rng = _RNG_LOCAL.rng = random.Random()
+    return rng
+
+
 def generate_clean_name():
-    return f"{fake.first_name()} {fake.last_name()}"
+    rng = _rng()
+    return f"{rng.choice(POOL_FIRST)} {rng.choice(POOL_LAST)}"
 
 
 def generate_matching_email(fake_name: str):
-    if not fake_name: return f"user{random.randint(1000, 9999)}@example.com"
+    rng = _rng()
+    if not fake_name: return f"user{1000 + (rng.getrandbits(13) % 9000)}@example.com"
     parts = fake_name.lower().split()
     base = f"{parts[0]}{parts[1]}" if len(parts) >= 2 else parts[0]
-    return f"{base}{random.randint(100, 9999)}@example.com"
+    return f"{base}{100 + (rng.getrandbits(14) % 9900)}@example.com"
 
 
 # --- UPDATED GENERATORS ---
 
 def generate_clean_phone():
     """Matches the requested format: +1-XXX-XXX-XXXX"""
-    return f"+1-{random.randint(200, 999)}-{random.randint(200, 999)}-{random.randint(1000, 9999)}"
+    rng = _rng()
+    return f"+1-{200 + (rng.getrandbits(10) % 800)}-{200 + (rng.getrandbits(10) % 800)}-{1000 + (rng.getrandbits(14) % 9000)}"
 
 
 def generate_medical_org():
@@ -74,181 +291,492 @@ def generate_medical_org():
     ]
     # 50% chance of City-based name (e.g. "Austin Regional Health")
     # 50% chance of Name-based name (e.g. "Rivera Medical Group")
-    prefix = fake.city() if random.random() > 0.5 else fake.last_name()
-    return f"{prefix} {random.choice(suffixes)}"
+    rng = _rng()
+    prefix = rng.choice(POOL_CITY) if rng.random() > 0.5 else rng.choice(POOL_LAST)
+    return f"{prefix} {rng.choice(suffixes)}"
 
 
-def get_fake_value(label: str, context: dict) -> str:
-    label = label.upper()
-
-    if "PERSON" in label:
-        val = generate_clean_name()
-        context["last_person"] = val
-        return val
-
-    if "EMAIL" in label:
-        return generate_matching_email(context.get("last_person", ""))
-
-    if "PHONE" in label:
-        return generate_clean_phone()  # <--- Uses new format
-
-    if "ADDRESS" in label or "LOCATION" in label:
-        # Fixes address leak by generating full block
-        return f"{fake.street_address()}, {fake.city()}, {fake.state_abbr()} {fake.zipcode()}"
-
-    if "MRN" in label:
-        return f"MRN-{fake.random_number(digits=8, fix_len=True)}"
-    if "SSN" in label:
-        return fake.ssn()
-    if "DATE" in label:
-        return str(fake.date_of_birth(minimum_age=18, maximum_age=90))
-    if "POLICY" in label:
-        return f"POL-{fake.random_number(digits=9, fix_len=True)}"
-    if "GROUP" in label:
-        return f"G{fake.random_number(digits=5, fix_len=True)}"
-
-    if "ORGANIZATION" in label:
-        return generate_medical_org()  # <--- Uses new medical generator
-
-    return f"REDACTED_{uuid.uuid4().hex[:6]}"
-
-
-def analyze_and_replace(text: str) -> (str, dict):
-    """Core logic to anonymize a single string block"""
-    findings = []
-    # Regex
-    for label, pattern in REGEX_PATTERNS.items():
-        for match in re.finditer(pattern, text):
-            findings.append({"start": match.start(), "end": match.end(), "label": label, "score": 1.0})
-    # AI
-    try:
-        ai_preds = model.predict_entities(text, AI_LABELS, threshold=0.35)
-        for p in ai_preds:
-            findings.append({"start": p["start"], "end": p["end"], "label": p["label"], "score": p["score"]})
-    except:
-        pass
-
-    # Merge
-    findings.sort(key=lambda x: x["start"])
-    merged = []
-    for f in findings:
-        if not merged:
-            merged.append(f)
-            continue
-        last = merged[-1]
-        if f["start"] < last["end"]:
-            if f["score"] > last["score"] or (f["end"] - f["start"]) > (last["end"] - last["start"]):
-                merged[-1] = f
-        else:
-            merged.append(f)
+def _handle_person(context):
+    val = generate_clean_name()
+    context["last_person"] = val
+    return val
 
-    # Generate Fakes
-    mapping = {}
-    replacements = []
-    context = {"last_person": ""}
-    used_fakes = set()
 
-    for ent in merged:
-        original = text[ent["start"]:ent["end"]]
-        # Skip JSON Keys
-        if original.lower() in ["person_name", "date_of_birth", "ssn", "mrn", "email", "phone", "address"]:
-            continue
+def _handle_email(context):
+    return generate_matching_email(context.get("last_person", ""))
 
-        fake_val = get_fake_value(ent["label"], context)
-        if fake_val in used_fakes:
-            fake_val = f"{fake_val}_{random.randint(1, 99)}"
-        used_fakes.add(fake_val)
 
-        mapping[fake_val] = original
-        replacements.append({"start": ent["start"], "end": ent["end"], "fake": fake_val})
+def _handle_phone(context):
+    return generate_clean_phone()
 
-    # Replace
-    replacements.sort(key=lambda x: x["start"], reverse=True)
-    text_chars = list(text)
-    for r in replacements:
-        text_chars[r["start"]:r["end"]] = list(r["fake"])
 
-    return "".join(text_chars), mapping
+def _handle_address(context):
+    # Fixes address leak by generating full block
+    rng = _rng()
+    return f"{rng.choice(POOL_STREET)}, {rng.choice(POOL_CITY)}, {rng.choice(POOL_STATE)} {rng.choice(POOL_ZIP)}"
 
 
-# --- ENDPOINTS ---
+def _handle_org(context):
+    return generate_medical_org()
 
-async def get_api_key(api_key: str = Security(api_key_header)):
-    if not api_key or api_key not in VALID_API_KEYS:
-        raise HTTPException(401, "Invalid API Key")
-    return api_key
 
+def _handle_mrn(context):
+    return f"MRN-{10000000 + (_rng().getrandbits(27) % 90000000)}"
 
-class AnonymizeRequest(BaseModel):
-    text: Union[str, List[Any], Dict[str, Any]]
 
+def _handle_ssn(context):
+    return _rng().choice(POOL_SSN)
 
-class RestoreRequest(BaseModel):
-    session_id: str
-    text: str
 
+def _handle_date(context):
+    return _rng().choice(POOL_DOB)
 
-@app.post("/v1/anonymize")
-async def anonymize(req: AnonymizeRequest, api_key: str = Security(get_api_key)):
-    input_data = req.text
-    global_mapping = {}
-    final_output_str = ""
 
-    # LOGIC: Handle List vs Single String
-    if isinstance(input_data, list):
-        # Process each item individually to avoid Token Limit
-        anonymized_list = []
-        for item in input_data:
-            item_str = json.dumps(item)
-            anon_str, item_map = analyze_and_replace(item_str)
-            anonymized_list.append(json.loads(anon_str))  # Convert back to dict
-            global_mapping.update(item_map)
+def _handle_policy(context):
+    return f"POL-{100000000 + (_rng().getrandbits(30) % 900000000)}"
+
+
+def _handle_group(context):
+    return f"G{10000 + (_rng().getrandbits(17) % 90000)}"
 
-        # Return as formatted JSON string
-        final_output_str = json.dumps(anonymized_list, indent=2)
 
+# The label vocabulary is fixed (REGEX_PATTERNS keys plus GLiNER's lowercase
+# AI_LABELS, normalized to upper), so dispatch is one dict lookup instead of
+# a chain of substring tests per entity.
+FAKE_HANDLERS = {
+    "PERSON": _handle_person,
+    "EMAIL_ADDRESS": _handle_email,
+    "PHONE_NUMBER": _handle_phone,
+    "FULL_ADDRESS": _handle_address,
+    "PHYSICAL ADDRESS": _handle_address,
+    "LOCATION": _handle_address,
+    "ORGANIZATION": _handle_org,
+    "MRN": _handle_mrn,
+    "SSN": _handle_ssn,
+    "DATE OF BIRTH": _handle_date,
+    "INSURANCE_POLICY": _handle_policy,
+    "INSURANCE_GROUP": _handle_group,
+}
+
+
+# Stateless labels can be bulk-drawn ahead of need; PERSON/EMAIL stay
+# sequential because matching emails depend on the last generated person.
+_BUFFERED_LABELS = frozenset(FAKE_HANDLERS) - {"PERSON", "EMAIL_ADDRESS"}
+_CANDIDATE_BATCH = 8
+
+
+def get_fake_value(label: str, context: dict) -> str:
+    key = label.upper()
+    handler = FAKE_HANDLERS.get(key)
+    if handler is None:
+        return f"REDACTED_{_rng().getrandbits(24).to_bytes(3, 'big').hex()}"
+    if key not in _BUFFERED_LABELS:
+        return handler(context)
+    # Entity-dense documents repeat types; refill a small per-document
+    # buffer in bursts and pop from it instead of dispatching every time
+    buffers = context.setdefault("candidates", {})
+    buf = buffers.get(key)
+    if not buf:
+        buf = buffers[key] = [handler(context) for _ in range(_CANDIDATE_BATCH)]
+    return buf.pop()
+
+
+def _collect_regex(text: str, starts: List[int], ends: List[int], labels: List[str], scores: List[float]):
+    """Regex findings appended into the columnar arrays: one Hyperscan pass
+    when available. Non-ASCII text goes through the union regex instead,
+    since Hyperscan reports byte offsets."""
+    if HS_DB is not None and text.isascii():
+        def on_match(pat_id, start, end, flags, ctx):
+            starts.append(start)
+            ends.append(end)
+            labels.append(REGEX_LABELS[pat_id])
+            scores.append(1.0)
+        HS_DB.scan(text.encode(), match_event_handler=on_match)
     else:
-        # Single object or string
-        text_to_process = json.dumps(input_data) if isinstance(input_data, dict) else str(input_data)
-        final_output_str, global_mapping = analyze_and_replace(text_to_process)
+        for match in UNION_PATTERN.finditer(text):
+            starts.append(match.start())
+            ends.append(match.end())
+            labels.append(match.lastgroup)
+            scores.append(1.0)
+
+
+# Window sizing for long texts: GLiNER's efficient regime ends around its
+# internal 384-token window, so long inputs are split into overlapping
+# whitespace-word windows and predicted as one batch.
+GLINER_WINDOW_WORDS = int(os.getenv("GLINER_WINDOW_WORDS", 350))
+GLINER_WINDOW_OVERLAP = int(os.getenv("GLINER_WINDOW_OVERLAP", 32))
+_WORD_SPLIT = re.compile(r'\S+')
+
+
+def _predict_window(text: str) -> List[dict]:
+    """Raw GLiNER call on one window, using cached label embeddings if available"""
+    text = text[:MAX_MODEL_CHARS]
+    with torch.inference_mode():
+        if LABEL_EMB is not None:
+            return model.predict_with_embeddings(text, LABEL_EMB, AI_LABELS, threshold=AI_THRESHOLD)
+        return model.predict_entities(text, AI_LABELS, threshold=AI_THRESHOLD)
+
+
+def _predict_batch_raw(texts: List[str]) -> List[List[dict]]:
+    """Single forward pass over window-sized texts. Callers split long
+    inputs with _make_windows first; the slice only guards against a
+    pathological single token longer than the cap."""
+    if hasattr(model, "batch_predict_entities"):
+        with torch.inference_mode():
+            return model.batch_predict_entities([t[:MAX_MODEL_CHARS] for t in texts], AI_LABELS, threshold=AI_THRESHOLD)
+    return [_predict_window(t) for t in texts]
+
+
+def _make_windows(text: str) -> (List[int], List[str]):
+    """Split text into overlapping word windows sized for one forward pass.
+
+    Returns parallel lists of character offsets and window texts; anything
+    that fits a single forward pass comes back as one window at offset 0."""
+    word_spans = [(m.start(), m.end()) for m in _WORD_SPLIT.finditer(text)]
+    if len(word_spans) <= GLINER_WINDOW_WORDS and len(text) <= MAX_MODEL_CHARS:
+        return [0], [text]
+
+    offsets = []
+    window_texts = []
+    i = 0
+    n = len(word_spans)
+    while i < n:
+        j = min(i + GLINER_WINDOW_WORDS, n)
+        start_c = word_spans[i][0]
+        while j - i > 1 and word_spans[j - 1][1] - start_c > MAX_MODEL_CHARS:
+            j -= 1
+        offsets.append(start_c)
+        window_texts.append(text[start_c:word_spans[j - 1][1]])
+        if j >= n:
+            break
+        i = max(i + 1, j - GLINER_WINDOW_OVERLAP)
+    return offsets, window_texts
+
+
+def _merge_window_preds(offsets: List[int], batches: List[List[dict]]) -> List[dict]:
+    """Re-offset window predictions into the original text, deduping spans
+    detected twice inside an overlap region by (start, end, label)."""
+    preds = []
+    seen = set()
+    for offset, window_preds in zip(offsets, batches):
+        for p in window_preds:
+            key = (p["start"] + offset, p["end"] + offset, p["label"])
+            if key in seen:
+                continue
+            seen.add(key)
+            p["start"] += offset
+            p["end"] += offset
+            preds.append(p)
+    return preds
+
+
+def _predict_entities(text: str) -> List[dict]:
+    """GLiNER inference over text of any length.
+
+    Short texts go straight through; long ones are split into overlapping
+    word windows (also capped at MAX_MODEL_CHARS each), predicted as one
+    batch, and the spans re-offset into the original text."""
+    offsets, window_texts = _make_windows(text)
+    if len(window_texts) == 1:
+        return _predict_window(text)
+    return _merge_window_preds(offsets, _predict_batch_raw(window_texts))
+
+
+def _predict_batch(texts: List[str]) -> List[List[dict]]:
+    """Batched inference over texts of any length: every text is windowed,
+    all windows run as one forward pass, and the spans are re-offset into
+    the text each window came from."""
+    window_offsets = []
+    window_counts = []
+    windows = []
+    for text in texts:
+        offsets, window_texts = _make_windows(text)
+        window_offsets.append(offsets)
+        window_counts.append(len(window_texts))
+        windows.extend(window_texts)
+    raw = _predict_batch_raw(windows)
+    results = []
+    pos = 0
+    for offsets, count in zip(window_offsets, window_counts):
+        results.append(_merge_window_preds(offsets, raw[pos:pos + count]))
+        pos += count
+    return results
+
+
+def _collect_ai_batch(texts: List[str]) -> List[List[dict]]:
+    """One batched GLiNER forward pass over every item in a list request"""
+    try:
+        return _predict_batch(texts)
+    except:
+        return [[] for _ in texts]
+
+
+# Structured payloads (JSON-serialized items are mostly braces, quotes and
+# numeric IDs) rarely yield AI entities but still cost a full forward pass;
+# require a few alphabetic words before invoking the model.
+AI_MIN_WORDS = int(os.getenv("AI_MIN_WORDS", 4))
+_ALPHA_WORD = re.compile(r'[A-Za-z]{2,}')
+
+# Cheap pre-filter for trivially-clean text: without a digit, an @, a URL,
+# or a capitalized word pair there is nothing for the regexes or the model
+# to find, and the whole pipeline can be skipped.
+_PII_HINT = re.compile(r"[@0-9]|https?://|(?:[A-Z][a-z]+\s+[A-Z][a-z]+)")
+
+
+def _should_run_ai(text: str) -> bool:
+    count = 0
+    for _ in _ALPHA_WORD.finditer(text):
+        count += 1
+        if count >= AI_MIN_WORDS:
+            return True
+    return False
+
+
+# JIT-compiled overlap sweep: pure integer/float arithmetic, so Numba takes
+# it off the bytecode interpreter for entity-dense payloads. Expects the
+# arrays pre-sorted by start; returns a keep mask.
+if njit is not None:
+    @njit(cache=True)
+    def _merge_spans_jit(starts, ends, scores):
+        n = starts.shape[0]
+        keep = np.zeros(n, dtype=np.bool_)
+        last = -1
+        for i in range(n):
+            if last < 0:
+                keep[i] = True
+                last = i
+            elif starts[i] < ends[last]:
+                if scores[i] > scores[last] or (ends[i] - starts[i]) > (ends[last] - starts[last]):
+                    keep[last] = False
+                    keep[i] = True
+                    last = i
+            else:
+                keep[i] = True
+                last = i
+        return keep
+else:
+    _merge_spans_jit = None
+
+
+# Detected spans for byte-identical texts are cached (chatbot workloads
+# resend system prompts and boilerplate verbatim); fake values are always
+# regenerated per call so sessions never share fakes. The lock guards the
+# OrderedDict across executor threads: get/move_to_end/popitem aren't safe
+# to interleave.
+_SPAN_CACHE = OrderedDict()
+_SPAN_CACHE_MAX = int(os.getenv("SPAN_CACHE_MAX", 4096))
+_SPAN_CACHE_LOCK = threading.Lock()
+
+
+def _detect_spans(text: str, ai_preds: List[dict] = None) -> List[tuple]:
+    """Regex + AI detection with overlap merge — the expensive half of the
+    pipeline. Findings are held as parallel columns (starts/ends/labels/
+    scores) rather than a dict per finding, and only materialized as
+    (start, end, label) tuples after the merge. Results are only cached
+    when predictions weren't supplied: the batched paths aren't guaranteed
+    byte-identical to the inline predictor, and mixing their outputs under
+    one text key would poison later lookups."""
+    cache_key = None
+    if ai_preds is None:
+        cache_key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        with _SPAN_CACHE_LOCK:
+            cached = _SPAN_CACHE.get(cache_key)
+            if cached is not None:
+                _SPAN_CACHE.move_to_end(cache_key)
+        if cached is not None:
+            return cached
+
+    starts: List[int] = []
+    ends: List[int] = []
+    labels: List[str] = []
+    scores: List[float] = []
+    _collect_regex(text, starts, ends, labels, scores)
+    # AI (skipped entirely when there's no prose for the model to work on)
+    if ai_preds is None:
+        if _should_run_ai(text):
+            try:
+                ai_preds = _predict_entities(text)
+            except:
+                ai_preds = []
+        else:
+            ai_preds = []
+    for p in ai_preds:
+        starts.append(p["start"])
+        ends.append(p["end"])
+        labels.append(p["label"])
+        scores.append(p["score"])
+
+    # Merge: index sort over the columns, then a single overlap sweep
+    # (JIT-compiled over int32/float32 arrays when Numba is installed)
+    # Sort key is (start, -length) so a longer span is seen first when two
+    # share a start; tuple comparison happens in C, no per-element lambda
+    if _merge_spans_jit is not None and starts:
+        s = np.asarray(starts, dtype=np.int32)
+        e = np.asarray(ends, dtype=np.int32)
+        sc = np.asarray(scores, dtype=np.float32)
+        order = np.lexsort((s - e, s))
+        keep = _merge_spans_jit(s[order], e[order], sc[order])
+        merged = [(starts[i], ends[i], labels[i]) for i in order[keep]]
+    else:
+        spans = [(starts[i], starts[i] - ends[i], i) for i in range(len(starts))]
+        spans.sort()
+        kept = []
+        for _, _, idx in spans:
+            if not kept:
+                kept.append(idx)
+                continue
+            last = kept[-1]
+            if starts[idx] < ends[last]:
+                if scores[idx] > scores[last] or (ends[idx] - starts[idx]) > (ends[last] - starts[last]):
+                    kept[-1] = idx
+            else:
+                kept.append(idx)
+        merged = [(starts[i], ends[i], labels[i]) for i in kept]
+
+    if cache_key is not None:
+        with _SPAN_CACHE_LOCK:
+            _SPAN_CACHE[cache_key] = merged
+            if len(_SPAN_CACHE) > _SPAN_CACHE_MAX:
+                _SPAN_CACHE.popitem(last=False)
+    return merged
+
+
+def _materialize_fakes(text: str, merged: List[tuple]) -> (str, dict):
+    """Generate fresh fake values for detected spans and rebuild the text"""
+    # Generate Fakes
+    mapping = {}
+    reverse = {}
+    replacements = []
+    context = {"last_person": ""}
+    fake_counts = Counter()
 
-    session_id = str(uuid.uuid4())
-    SESSIONS[session_id] = {"mapping": global_mapping, "created": datetime.now(), "api_key": api_key}
+    for start, end, label in merged:
+        original = text[start:end]
+        # Skip JSON Keys
+        if original.lower() in ["person_name", "date_of_birth", "ssn", "mrn", "email", "phone", "address"]:
+            continue
 
-    return {
-        "anonymized_text": final_output_str,
-        "session_id": session_id,
-        "entities_found": len(global_mapping)
-    }
+        # Identical originals share one fake: the same name appearing twice
+        # stays the same alias (coherent for the LLM) and the mapping stays
+        # one entry per distinct value
+        fake_val = reverse.get(original)
+        if fake_val is None:
+            fake_val = get_fake_value(label, context)
+            # Monotonic suffix on collision: guaranteed unique, unlike the old
+            # random suffix which could collide again unretried
+            n = fake_counts[fake_val]
+            fake_counts[fake_val] += 1
+            if n:
+                fake_val = f"{fake_val}_{n + 1}"
+            reverse[original] = fake_val
+            mapping[fake_val] = original
+
+        replacements.append((start, end, fake_val))
+
+    # Replace: single forward walk over the text (replacements are already
+    # in ascending start order from the merge step), written into one
+    # growable buffer instead of a list of slice objects
+    buf = io.StringIO()
+    cursor = 0
+    for start, end, fake_val in replacements:
+        buf.write(text[cursor:start])
+        buf.write(fake_val)
+        cursor = end
+    buf.write(text[cursor:])
+
+    return buf.getvalue(), mapping
+
+
+def _build_automaton(mapping: dict):
+    """Aho-Corasick automaton over the fake values, or None without the package"""
+    if ahocorasick is None or not mapping:
+        return None
+    automaton = ahocorasick.Automaton()
+    for fake, real in mapping.items():
+        automaton.add_word(fake, (fake, real))
+    automaton.make_automaton()
+    return automaton
+
+
+# Large single texts are split at paragraph boundaries and anonymized
+# concurrently; chunk outputs concatenate back to the full document.
+CHUNK_THRESHOLD = int(os.getenv("CHUNK_THRESHOLD", 2000))
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", 1200))
+
+
+def _split_chunks(text: str, max_chars: int) -> List[str]:
+    """Cut the text into pieces of at most max_chars, preferring the last
+    paragraph break inside each budget; concatenating the pieces yields the
+    original text exactly."""
+    chunks = []
+    start = 0
+    while len(text) - start > max_chars:
+        cut = text.rfind("\n\n", start + 1, start + max_chars)
+        if cut <= start:
+            cut = start + max_chars
+        chunks.append(text[start:cut])
+        start = cut
+    chunks.append(text[start:])
+    return chunks
+
+
+def _exact_restore(text: str, mapping: dict, sorted_items: list = None, automaton=None) -> str:
+    """Swap every fake value back to its original.
+
+    With pyahocorasick this is a single O(len(text)) sweep that prefers the
+    longest leftmost match; otherwise falls back to longest-first
+    str.replace, which scans the text once per mapping entry."""
+    if not mapping:
+        return text
+    if automaton is None:
+        automaton = _build_automaton(mapping)
+    if automaton is None:
+        if sorted_items is None:
+            sorted_items = sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True)
+        for fake, real in sorted_items:
+            text = text.replace(fake, real)
+        return text
+
+    spans = []
+    for end_idx, (fake, real) in automaton.iter(text):
+        spans.append((end_idx - len(fake) + 1, end_idx + 1, real))
+    # Longest-leftmost wins, same greedy policy as the longest-key sort
+    spans.sort(key=lambda s: (s[0], s[0] - s[1]))
+    out = []
+    cursor = 0
+    for start, end, real in spans:
+        if start < cursor:
+            continue
+        out.append(text[cursor:start])
+        out.append(real)
+        cursor = end
+    out.append(text[cursor:])
+    return "".join(out)
 
 
-@app.post("/v1/restore")
-async def restore(req: RestoreRequest, api_key: str = Security(get_api_key)):
-    session = SESSIONS.get(req.session_id)
-    if not session or session["api_key"] != api_key:
-        raise HTTPException(404, "Session not found")
+# Captures various formats: +1-555... | (555)... | 555.555... | 555 555...
+# \W matches non-word chars, including unicode hyphens the LLM might use
+PHONE_RESTORE_PATTERN = re.compile(r'(?:\+?1[\W_]?)?\(?\d{3}\)?[\W_]?\d{3}[\W_]?\d{4}')
 
-    text = req.text
-    mapping = session["mapping"]
 
-    # --- Helper: Normalize text to just digits for phone matching ---
-    def get_digits(s):
-        return "".join(filter(str.isdigit, s))
+def _get_digits(s: str) -> str:
+    """Normalize text to just digits for phone matching"""
+    return "".join(filter(str.isdigit, s))
 
-    # --- 1. Exact Match (Highest Priority) ---
-    # Sort by length (longest first) to prevent substring collisions
-    # e.g. Replace "Joanna Torres" before "Joanna"
-    for fake, real in sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True):
-        text = text.replace(fake, real)
 
-    # --- 2. Build Partial Mappings (Smart Repair) ---
+def _build_restore_cache(mapping: dict, item_mappings: list = None) -> dict:
+    """Derive the fuzzy-repair structures for a mapping once per session:
+    partial word maps, phone digit maps, and compiled alternation patterns
+    so each restore call scans the text a constant number of times. For
+    list sessions, per-item longest-first orderings and automata are
+    derived too so item-scoped restores share the same replacement order."""
     partial_map = {}
     phone_map = {}
 
     for fake_full, real_full in mapping.items():
         # A. Phone Numbers: Map digits -> Real Number
         # If the fake value has 10+ digits, store it for fuzzy matching
-        f_digits = get_digits(fake_full)
+        f_digits = _get_digits(fake_full)
         if len(f_digits) >= 10:
             phone_map[f_digits] = real_full
 
@@ -279,39 +807,344 @@ async def restore(req: RestoreRequest, api_key: str = Security(get_api_key)):
                 # Store root word mapping
                 partial_map[fake_parts[0]] = real_full
 
-    # --- 3. Apply Phone Number Fixes (Regex) ---
-    # Captures various formats: +1-555... | (555)... | 555.555... | 555 555...
-    # \W matches non-word chars, including unicode hyphens the LLM might use
-    phone_pattern = r'(?:\+?1[\W_]?)?\(?\d{3}\)?[\W_]?\d{3}[\W_]?\d{4}'
+    cache = {
+        "partial_map": partial_map,
+        "phone_map": phone_map,
+        "sorted_mapping": sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True),
+        "automaton": _build_automaton(mapping),
+        "item_restores": [
+            (sorted(m.items(), key=lambda x: len(x[0]), reverse=True), _build_automaton(m))
+            for m in item_mappings
+        ] if item_mappings else None,
+        "word_re": None,
+        "ci_re": None,
+        "ci_lookup": {},
+    }
+
+    # Longest keys first inside the alternation so "Kennethburgh" beats "Ken"
+    ordered = sorted(partial_map, key=len, reverse=True)
+    if ordered:
+        cache["word_re"] = re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in ordered) + r')\b')
+    # Aggressive case-insensitive cleanup only for long unique keywords;
+    # collapse spaces in the replacement for email-domain compatibility
+    ci_keys = [k for k in ordered if len(k) > 5]
+    if ci_keys:
+        cache["ci_re"] = re.compile('|'.join(re.escape(k) for k in ci_keys), re.IGNORECASE)
+        cache["ci_lookup"] = {k.lower(): partial_map[k].replace(" ", "") for k in ci_keys}
+    return cache
+
+
+def analyze_and_replace(text: str, ai_preds: List[dict] = None) -> (str, dict):
+    """Core logic to anonymize a single string block.
 
+    ai_preds lets the list branch pass in predictions from a single batched
+    forward pass instead of running the model once per item."""
+    if not _PII_HINT.search(text):
+        return text, {}
+    return _materialize_fakes(text, _detect_spans(text, ai_preds))
+
+
+# --- ENDPOINTS ---
+
+class ModelBatcher:
+    """Micro-batches GLiNER calls across concurrent requests.
+
+    Handlers await predict(); texts arriving within max_wait of each other
+    are run as one batched forward pass on the executor, and each awaiting
+    coroutine gets back its own predictions."""
+
+    def __init__(self, max_batch: int, max_wait_ms: int):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+
+    async def predict(self, text: str) -> List[dict]:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, fut))
+        return await fut
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            texts = [t for t, _ in batch]
+            results = await loop.run_in_executor(EXECUTOR, _collect_ai_batch, texts)
+            for (_, fut), preds in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(preds)
+
+
+BATCHER = ModelBatcher(int(os.getenv("AI_BATCH_MAX", 8)), int(os.getenv("AI_BATCH_WAIT_MS", 10)))
+
+
+@app.on_event("startup")
+async def start_batcher():
+    BATCHER.start()
+
+
+@app.on_event("startup")
+async def start_session_reaper():
+    """Actively purge expired sessions instead of waiting for cache access.
+
+    TTLCache only drops stale entries lazily when it's touched, so abandoned
+    sessions would otherwise sit in memory for the life of the process. The
+    Redis backend expires server-side and needs no reaping."""
+    async def _reaper():
+        while True:
+            await asyncio.sleep(60)
+            if REDIS is None:
+                async with SESSIONS_LOCK:
+                    SESSIONS.expire()
+
+    asyncio.create_task(_reaper())
+
+
+@app.on_event("startup")
+async def connect_redis():
+    global REDIS
+    if REDIS_URL:
+        if aioredis is None:
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+        REDIS = aioredis.from_url(REDIS_URL)
+
+
+@app.on_event("startup")
+async def warmup():
+    """Run one representative text through the full pipeline so the first
+    real request doesn't pay model/kernel initialization: the string below
+    exercises every regex recognizer plus the GLiNER forward pass."""
+    warm_text = (
+        "John Doe (MRN-123456, SSN 123-45-6789) of 42 Oak Street, Austin, TX 73301 "
+        "can be reached at john@example.com or 555-123-4567 about policy POL-987654 "
+        "with Austin Regional Medical Center, group G12345."
+    )
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(EXECUTOR, analyze_and_replace, warm_text)
+
+
+async def get_api_key(api_key: str = Security(api_key_header)):
+    if not api_key:
+        raise HTTPException(401, "Invalid API Key")
+    candidate = api_key.encode()
+    if not any(hmac.compare_digest(candidate, valid) for valid in VALID_API_KEYS):
+        raise HTTPException(401, "Invalid API Key")
+    return api_key
+
+
+class AnonymizeRequest(BaseModel):
+    text: Union[str, List[Any], Dict[str, Any]]
+
+
+class RestoreRequest(BaseModel):
+    session_id: str
+    text: str
+
+
+@app.post("/v1/anonymize")
+async def anonymize(req: AnonymizeRequest, api_key: str = Security(get_api_key)):
+    input_data = req.text
+    global_mapping = {}
+    item_mappings = None
+    final_output_str = ""
+
+    # LOGIC: Handle List vs Single String
+    if isinstance(input_data, list):
+        # Process each item individually to avoid Token Limit,
+        # but run GLiNER once over the whole batch and fan the per-item
+        # regex/replace work out over the thread pool
+        anonymized_list = []
+        loop = asyncio.get_running_loop()
+        item_strs = [_json_dumps(item) for item in input_data]
+        # Items that are mostly braces and numeric IDs never yield AI
+        # entities; batch only the ones with enough prose and hand the
+        # rest empty predictions
+        batch_preds = [[] for _ in item_strs]
+        ai_idx = [i for i, s in enumerate(item_strs)
+                  if _PII_HINT.search(s) and _should_run_ai(s)]
+        if ai_idx:
+            preds = await loop.run_in_executor(
+                EXECUTOR, _collect_ai_batch, [item_strs[i] for i in ai_idx])
+            for i, item_preds in zip(ai_idx, preds):
+                batch_preds[i] = item_preds
+
+        async def _process(item_str, item_preds):
+            async with ANON_CONCURRENCY:
+                return await loop.run_in_executor(EXECUTOR, analyze_and_replace, item_str, item_preds)
+
+        results = await asyncio.gather(*(_process(s, p) for s, p in zip(item_strs, batch_preds)))
+        # Keep each item's mapping separately: merging into one flat dict can
+        # silently overwrite when two items draw the same fake value, and
+        # restore can then swap in the wrong original
+        item_mappings = []
+        for anon_str, item_map in results:
+            anonymized_list.append(_json_loads(anon_str))  # Convert back to dict
+            item_mappings.append(item_map)
+            global_mapping.update(item_map)
+
+        # Return as formatted JSON string
+        final_output_str = _json_pretty(anonymized_list)
+
+    else:
+        # Single object or string
+        text_to_process = _json_dumps(input_data) if isinstance(input_data, dict) else str(input_data)
+        loop = asyncio.get_running_loop()
+        if len(text_to_process) > CHUNK_THRESHOLD:
+            # Large documents: anonymize paragraph-sized chunks concurrently
+            async def _process_chunk(chunk):
+                async with ANON_CONCURRENCY:
+                    return await loop.run_in_executor(EXECUTOR, analyze_and_replace, chunk)
+
+            chunks = _split_chunks(text_to_process, CHUNK_MAX_CHARS)
+            results = await asyncio.gather(*(_process_chunk(c) for c in chunks))
+            # Chunks draw fakes independently, so two chunks can pick the
+            # same fake for different originals; suffix the later one (same
+            # policy as _materialize_fakes) instead of letting the merge
+            # silently overwrite the first mapping entry
+            anonymized_chunks = []
+            for anon_chunk, chunk_map in results:
+                for fake_val, original in chunk_map.items():
+                    if global_mapping.get(fake_val) == original:
+                        continue
+                    if fake_val in global_mapping:
+                        n = 2
+                        while f"{fake_val}_{n}" in global_mapping or f"{fake_val}_{n}" in chunk_map:
+                            n += 1
+                        suffixed = f"{fake_val}_{n}"
+                        # \w guard so a fake that prefixes another fake in
+                        # this chunk (e.g. its own suffixed twin) survives
+                        anon_chunk = re.sub(re.escape(fake_val) + r'(?!\w)',
+                                            lambda m: suffixed, anon_chunk)
+                        fake_val = suffixed
+                    global_mapping[fake_val] = original
+                anonymized_chunks.append(anon_chunk)
+            final_output_str = "".join(anonymized_chunks)
+        else:
+            ai_preds = []
+            if _PII_HINT.search(text_to_process) and _should_run_ai(text_to_process):
+                if len(text_to_process) <= MAX_MODEL_CHARS:
+                    # Short texts micro-batch with other in-flight requests
+                    ai_preds = await BATCHER.predict(text_to_process)
+                else:
+                    # Multi-window texts skip the shared micro-batch (their
+                    # windows would stall everyone else's batch) and run the
+                    # windowed predictor on the executor instead
+                    ai_preds = None
+            final_output_str, global_mapping = await loop.run_in_executor(
+                EXECUTOR, analyze_and_replace, text_to_process, ai_preds)
+
+    # token_urlsafe is faster and shorter than a formatted uuid4, and the
+    # session id only needs to be unguessable, not a UUID
+    session_id = secrets.token_urlsafe(16)
+    # Derived restore structures are constant per session; build them now so
+    # every /v1/restore call (chatbots make many per session) skips the work.
+    restore_cache = _build_restore_cache(global_mapping, item_mappings)
+    await _put_session(session_id, {
+        "mapping": global_mapping,
+        "item_mappings": item_mappings,
+        "api_key": api_key,
+        "restore_cache": restore_cache,
+    })
+
+    return {
+        "anonymized_text": final_output_str,
+        "session_id": session_id,
+        "entities_found": len(global_mapping)
+    }
+
+
+def _restore_text(session: dict, text: str) -> str:
+    """CPU-bound restore pipeline (exact pass plus fuzzy repairs), kept sync
+    so the endpoint can offload it to the executor."""
+    mapping = session["mapping"]
+
+    # Derived structures are precomputed at anonymize time (lazy rebuild kept
+    # as a safety net for artifacts evicted from the side LRU), including
+    # the compiled patterns
+    cache = session.get("restore_cache")
+    if cache is None:
+        cache = _build_restore_cache(mapping, session.get("item_mappings"))
+        with RESTORE_CACHES_LOCK:
+            RESTORE_CACHES[session["session_id"]] = cache
+    partial_map = cache["partial_map"]
+    phone_map = cache["phone_map"]
+
+    # --- 1. Exact Match (Highest Priority) ---
+    # List sessions that come back as JSON lists are restored item-by-item
+    # against their own mappings, so one item's fakes can't clobber
+    # another's. Anything else goes through the merged mapping in a single
+    # Aho-Corasick pass (or longest-first replace fallback) to prevent
+    # substring collisions, e.g. Replace "Joanna Torres" before "Joanna"
+    item_mappings = session.get("item_mappings")
+    restored_per_item = False
+    if item_mappings:
+        try:
+            items = _json_loads(text)
+        except:
+            items = None
+        if isinstance(items, list) and len(items) == len(item_mappings):
+            item_restores = cache.get("item_restores") or [(None, None)] * len(item_mappings)
+            restored_items = [
+                _json_loads(_exact_restore(_json_dumps(item), item_map, sorted_items, automaton))
+                for item, item_map, (sorted_items, automaton) in zip(items, item_mappings, item_restores)
+            ]
+            text = _json_pretty(restored_items)
+            restored_per_item = True
+    if not restored_per_item:
+        text = _exact_restore(text, mapping, cache["sorted_mapping"], cache["automaton"])
+
+    # --- 3. Apply Phone Number Fixes (Regex) ---
     def phone_replacer(match):
         found_num = match.group(0)
-        found_digits = get_digits(found_num)
+        found_digits = _get_digits(found_num)
         # Check if the found digits match any of our fake numbers
         for fake_digits, real_num in phone_map.items():
             if fake_digits in found_digits:
                 return real_num
         return found_num
 
-    text = re.sub(phone_pattern, phone_replacer, text)
+    text = PHONE_RESTORE_PATTERN.sub(phone_replacer, text)
 
     # --- 4. Apply Partial Text Fixes (Regex Boundaries) ---
-    # Sort keys by length to replace "Kennethburgh" before "Ken"
-    for fake_part, real_part in sorted(partial_map.items(), key=lambda x: len(x[0]), reverse=True):
-        # Case 1: Word Boundary Match (Preserves whole words)
-        # Matches "Joanna" in "Hello Joanna," but not in "Joannasaurus"
-        pattern = r'\b' + re.escape(fake_part) + r'\b'
-        text = re.sub(pattern, real_part, text)
-
-        # Case 2: Aggressive Org Cleanup (Case-Insensitive)
-        # Handles the email domain issue: "info@kennethburghhealth.org"
-        # If we have a long unique keyword (like Kennethburgh), replace it even inside other strings
-        if len(fake_part) > 5:
-            # Collapse spaces in real_part for email compatibility (Blue Cross -> BlueCross)
-            clean_real = real_part.replace(" ", "")
-            text = re.sub(re.escape(fake_part), clean_real, text, flags=re.IGNORECASE)
-
-    return {"restored_text": text}
+    # Case 1: Word Boundary Match (Preserves whole words)
+    # Matches "Joanna" in "Hello Joanna," but not in "Joannasaurus"
+    if cache["word_re"] is not None:
+        text = cache["word_re"].sub(lambda m: partial_map[m.group(0)], text)
+
+    # Case 2: Aggressive Org Cleanup (Case-Insensitive)
+    # Handles the email domain issue: "info@kennethburghhealth.org" --
+    # long unique keywords get replaced even inside other strings
+    if cache["ci_re"] is not None:
+        ci_lookup = cache["ci_lookup"]
+        text = cache["ci_re"].sub(lambda m: ci_lookup.get(m.group(0).lower(), m.group(0)), text)
+
+    return text
+
+
+@app.post("/v1/restore")
+async def restore(req: RestoreRequest, api_key: str = Security(get_api_key)):
+    session = await _get_session(req.session_id)
+    if not session or session["api_key"] != api_key:
+        raise HTTPException(404, "Session not found")
+
+    # The regex/automaton passes are pure CPU; run them on the executor so
+    # they don't stall other connections on the event loop
+    loop = asyncio.get_running_loop()
+    restored = await loop.run_in_executor(EXECUTOR, _restore_text, session, req.text)
+    return {"restored_text": restored}
 
 
 if __name__ == "__main__":